@@ -3,8 +3,14 @@
 
 import streamlit as st
 import pandas as pd
-import json
+import numpy as np
+import orjson
 import os
+import sys
+import threading
+import simdjson
+from numba import njit
+from concurrent.futures import ProcessPoolExecutor
 import matplotlib.pyplot as plt
 from matplotlib.patches import Rectangle
 from mplsoccer import Pitch
@@ -21,103 +27,236 @@ st.set_page_config(
 DATA_PATH = "data/statsbomb_wc2022"
 MATCHES_PATH = os.path.join(DATA_PATH, "matches/wc2022_matches.json")
 EVENTS_DIR = os.path.join(DATA_PATH, "events")
+CACHE_DIR = "cache"
+EVENTS_CACHE_PATH = os.path.join(CACHE_DIR, "events.parquet")
+EVENTS_MANIFEST_PATH = os.path.join(CACHE_DIR, "events_manifest.json")
+PLAYERS_CACHE_PATH = os.path.join(CACHE_DIR, "players.json")
+EVENTS_CACHE_VERSION = 4  # bump when build_clean_events output changes
 
 MESSI_ID = 5503
 MESSI_NAME = "Lionel Andrés Messi Cuccittini"
 FINAL_THIRD_X = 80
+OPEN_PLAY_EXCLUDE = ["Corner", "Free Kick", "Throw-in", "Kick Off"]
+# StatsBomb pitch coordinates (0-120 x 0-80, one decimal) and xG (0-1) are
+# exact enough in float32; ids and minutes fit comfortably in int32
+EVENT_DTYPES = {
+    "match_id": np.int32,
+    "player_id": np.int32,
+    "player_name": object,
+    "event_type": object,
+    "x": np.float32,
+    "y": np.float32,
+    "end_x": np.float32,
+    "end_y": np.float32,
+    "shot_assist": np.bool_,
+    "xg": np.float32,
+    "minute": np.int32,
+}
 
 # ===============================
 # DATA LOADING (CACHED)
 # ===============================
+@st.cache_data
 def load_matches():
-    with open(MATCHES_PATH, "r", encoding="utf-8") as f:
-        return pd.DataFrame(json.load(f))
+    with open(MATCHES_PATH, "rb") as f:
+        df = pd.DataFrame(orjson.loads(f.read()))
+
+    # Flatten team names once so match lookups are plain column comparisons
+    df["home_team_name"] = pd.json_normalize(df["home_team"])["home_team_name"].values
+    df["away_team_name"] = pd.json_normalize(df["away_team"])["away_team_name"].values
+    df["label"] = df["home_team_name"] + " vs " + df["away_team_name"]
+    return df
         
-def find_match_id(df_matches, team1, team2):
-    match = df_matches[
-        (
-            df_matches["home_team"].apply(
-                lambda x: isinstance(x, dict) and x.get("home_team_name") == team1
-            ) &
-            df_matches["away_team"].apply(
-                lambda x: isinstance(x, dict) and x.get("away_team_name") == team2
-            )
-        ) |
-        (
-            df_matches["home_team"].apply(
-                lambda x: isinstance(x, dict) and x.get("home_team_name") == team2
-            ) &
-            df_matches["away_team"].apply(
-                lambda x: isinstance(x, dict) and x.get("away_team_name") == team1
-            )
-        )
+@st.cache_data
+def find_match_id(_df_matches, team1, team2):
+    # Match metadata is static, so the lookup is keyed on the team names only
+    home = _df_matches["home_team_name"]
+    away = _df_matches["away_team_name"]
+    match = _df_matches[
+        ((home == team1) & (away == team2)) |
+        ((home == team2) & (away == team1))
     ]
 
     if match.empty:
-        st.error(f"No match found for {team1} vs {team2}")
-        st.stop()
+        return None
 
     return int(match.iloc[0]["match_id"])
 
 
 
-def build_clean_events(df_matches):
-    OPEN_PLAY_EXCLUDE = ["Corner", "Free Kick", "Throw-in", "Kick Off"]
-    event_rows = []
-
-    for match_id in tqdm(df_matches["match_id"]):
-        with open(os.path.join(EVENTS_DIR, f"{match_id}.json"), "r", encoding="utf-8") as f:
-            events = json.load(f)
+def parse_match_events(parser, match_id):
+    # simdjson proxies stay lazy: only the fields read below are materialised,
+    # and none of them outlive this call so the parser can be reused.
+    with open(os.path.join(EVENTS_DIR, f"{match_id}.json"), "rb") as f:
+        events = parser.parse(f.read())
 
-        for e in events:
-            event_type = e.get("type", {}).get("name")
-            if event_type not in ["Pass", "Shot"]:
+    # One typed array per column, sized for the whole match and trimmed to
+    # the k open-play passes and shots actually kept.
+    n = len(events)
+    cols = {
+        c: np.full(n, np.nan, dtype=t) if np.dtype(t).kind == "f" else np.zeros(n, dtype=t)
+        for c, t in EVENT_DTYPES.items() if c != "match_id"
+    }
+    players = {}
+
+    k = 0
+    for e in events:
+        event_type = e["type"]["name"]
+        if event_type not in ["Pass", "Shot"]:
+            continue
+
+        if event_type == "Pass":
+            p = e["pass"]
+            pass_type = p.get("type")
+            if pass_type is not None and pass_type["name"] in OPEN_PLAY_EXCLUDE:
                 continue
+            end_location = p.get("end_location")
+            if end_location is not None:
+                cols["end_x"][k], cols["end_y"][k] = end_location[0], end_location[1]
+            cols["shot_assist"][k] = p.get("shot_assist", False)
+
+        if event_type == "Shot":
+            xg = e["shot"].get("statsbomb_xg")
+            if xg is not None:
+                cols["xg"][k] = xg
+
+        player = e["player"]
+        player_id, player_name = player["id"], player["name"]
+        cols["player_id"][k] = player_id
+        cols["player_name"][k] = player_name
+        if player_id not in players:
+            players[player_id] = player_name
+        cols["event_type"][k] = event_type
+        location = e.get("location")
+        if location is not None:
+            cols["x"][k], cols["y"][k] = location[0], location[1]
+        cols["minute"][k] = e["minute"]
+        k += 1
+
+    cols = {c: arr[:k] for c, arr in cols.items()}
+    cols["match_id"] = np.full(k, match_id, dtype=EVENT_DTYPES["match_id"])
+    return cols, players
+
+
+def parse_match_file(match_id):
+    # Worker entry point: simdjson parsers can't be shared across processes
+    return parse_match_events(simdjson.Parser(), match_id)
 
-            row = {
-                "match_id": match_id,
-                "player_id": e.get("player", {}).get("id"),
-                "player_name": e.get("player", {}).get("name"),
-                "event_type": event_type,
-                "x": e.get("location", [None, None])[0],
-                "y": e.get("location", [None, None])[1],
-                "end_x": None,
-                "end_y": None,
-                "shot_assist": False,
-                "xg": None,
-                "minute": e.get("minute")
-            }
 
-            if event_type == "Pass":
-                p = e.get("pass", {})
-                if p.get("type", {}).get("name") in OPEN_PLAY_EXCLUDE:
-                    continue
-                row["end_x"], row["end_y"] = p.get("end_location", [None, None])
-                row["shot_assist"] = p.get("shot_assist", False)
-
-            if event_type == "Shot":
-                row["xg"] = e.get("shot", {}).get("statsbomb_xg")
-
-            event_rows.append(row)
-
-    return pd.DataFrame(event_rows)
+def build_clean_events(df_matches):
+    # Match files are independent, so they are parsed across worker processes
+    match_ids = df_matches["match_id"].tolist()
+    with ProcessPoolExecutor() as ex:
+        match_results = list(tqdm(
+            ex.map(parse_match_file, match_ids, chunksize=4),
+            total=len(match_ids),
+            miniters=8,
+            disable=not sys.stderr.isatty()
+        ))
+
+    player_names = {}
+    for _, players in match_results:
+        player_names.update(players)
+
+    df = pd.DataFrame({
+        c: np.concatenate([cols[c] for cols, _ in match_results])
+        for c in EVENT_DTYPES
+    })
+    # Low-cardinality strings: equality checks become integer code comparisons
+    df["event_type"] = df["event_type"].astype("category")
+    df["player_name"] = df["player_name"].astype("category")
+
+    # Sorted match_id index turns per-match lookups into a range slice
+    df = df.set_index("match_id").sort_index(kind="stable")
+    return df, player_names
+
+
+@st.cache_resource
+def load_clean_events(_df_matches):
+    # The event files never change between deploys, so the cleaned table is
+    # written to Parquet once and rebuilt only when the events dir is touched.
+    events_mtime = os.path.getmtime(EVENTS_DIR)
+
+    if os.path.exists(EVENTS_CACHE_PATH) and os.path.exists(EVENTS_MANIFEST_PATH):
+        with open(EVENTS_MANIFEST_PATH, "rb") as f:
+            manifest = orjson.loads(f.read())
+        if manifest == {"events_mtime": events_mtime, "version": EVENTS_CACHE_VERSION}:
+            with open(PLAYERS_CACHE_PATH, "rb") as f:
+                player_names = dict(orjson.loads(f.read()))
+            return pd.read_parquet(EVENTS_CACHE_PATH), player_names
+
+    df, player_names = build_clean_events(_df_matches)
+
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    df.to_parquet(EVENTS_CACHE_PATH, compression="snappy")
+    with open(PLAYERS_CACHE_PATH, "wb") as f:
+        f.write(orjson.dumps(list(player_names.items())))
+    with open(EVENTS_MANIFEST_PATH, "wb") as f:
+        f.write(orjson.dumps({"events_mtime": events_mtime, "version": EVENTS_CACHE_VERSION}))
+
+    return df, player_names
+
+
+@njit(cache=True)
+def aggregate_player_stats(codes, etype, pass_code, x, sa, xg,
+                           out_fp, out_sa, out_xg):
+    # Single pass over the events, accumulating per-player counts into the
+    # preallocated output arrays
+    for i in range(codes.shape[0]):
+        p = codes[i]
+
+        if etype[i] == pass_code:
+            if x[i] >= 80:
+                out_fp[p] += 1
+            if sa[i]:
+                out_sa[p] += 1
+
+        if not np.isnan(xg[i]):
+            out_xg[p] += xg[i]
+
+
+def minutes_played_per_player(codes, match_codes, minute):
+    # Sort by (player, match) so both levels are contiguous runs, then reduce
+    # each run at its boundaries instead of hashing (match, player) pairs
+    order = np.lexsort((match_codes, codes))
+    codes, match_codes, minute = codes[order], match_codes[order], minute[order]
+
+    new_pair = np.r_[True, (codes[1:] != codes[:-1]) | (match_codes[1:] != match_codes[:-1])]
+    pair_starts = np.flatnonzero(new_pair)
+    played = np.maximum.reduceat(minute, pair_starts) - np.minimum.reduceat(minute, pair_starts)
+    played = np.clip(played, 1, None)
+
+    pair_codes = codes[pair_starts]
+    player_starts = np.flatnonzero(np.r_[True, pair_codes[1:] != pair_codes[:-1]])
+    return np.add.reduceat(played, player_starts)
 
 
 def build_per90(df):
-    minutes = (
-        df.dropna(subset=["player_id", "minute"])
-        .groupby(["match_id", "player_id"])
-        .minute.agg(["min", "max"])
-        .reset_index()
+    codes, player_ids = pd.factorize(df.player_id)
+    match_codes, _ = pd.factorize(df.index)
+    n_players = len(player_ids)
+
+    out_fp = np.zeros(n_players, dtype=np.int64)
+    out_sa = np.zeros(n_players, dtype=np.int64)
+    out_xg = np.zeros(n_players, dtype=np.float64)
+
+    aggregate_player_stats(
+        codes,
+        df.event_type.cat.codes.to_numpy(), df.event_type.cat.categories.get_loc("Pass"),
+        df.x.to_numpy(), df.shot_assist.to_numpy(), df.xg.to_numpy(),
+        out_fp, out_sa, out_xg
     )
-    minutes["minutes_played"] = (minutes["max"] - minutes["min"]).clip(lower=1)
-    minutes = minutes.groupby("player_id")["minutes_played"].sum().reset_index()
 
-    passes = df[(df.event_type == "Pass") & (df.x >= 80)].groupby("player_id").size().reset_index(name="final_third_passes")
-    assists = df[(df.event_type == "Pass") & (df.shot_assist)].groupby("player_id").size().reset_index(name="shot_assists")
-    xg = df[df.xg.notna()].groupby("player_id")["xg"].sum().reset_index()
+    # factorize codes are 0..n_players-1, so per-player runs come out in code order
+    minutes_played = minutes_played_per_player(codes, match_codes, df.minute.to_numpy())
 
-    out = minutes.merge(passes, how="left").merge(assists, how="left").merge(xg, how="left").fillna(0)
+    out = pd.DataFrame({
+        "player_id": player_ids,
+        "minutes_played": minutes_played,
+        "final_third_passes": out_fp,
+        "shot_assists": out_sa,
+        "xg": out_xg,
+    })
     out = out[out.minutes_played >= 300]
 
     out["final_third_passes_per90"] = out.final_third_passes / out.minutes_played * 90
@@ -129,46 +268,81 @@ def build_per90(df):
 # ===============================
 # VISUALS
 # ===============================
-def draw_final_third_pass_map(df_passes, title):
+@st.cache_resource
+def get_blank_pass_map():
+    # Pitch construction is the slow part of the pass map, so one blank
+    # figure is kept per process; the lock serialises sessions drawing on it
     pitch = Pitch(pitch_type="statsbomb", half=True)
     fig, ax = pitch.draw(figsize=(6.5, 4))
 
     ax.add_patch(Rectangle((FINAL_THIRD_X, 0), 120 - FINAL_THIRD_X, 80,
                            facecolor="yellow", alpha=0.25))
 
-    for _, r in df_passes.iterrows():
-        pitch.arrows(r.x, r.y, r.end_x, r.end_y,
-                     ax=ax,
-                     color="red" if r.shot_assist else "blue",
-                     width=2,
-                     alpha=0.7)
+    return pitch, fig, ax, threading.Lock()
 
-    ax.set_title(title)
-    st.pyplot(fig)
-    plt.close(fig)
 
-def get_player_lookup(df):
+def draw_final_third_pass_map(df_passes, title):
+    pitch, fig, ax, lock = get_blank_pass_map()
+
+    with lock:
+        arrows = []
+        try:
+            for is_shot_assist, color in [(False, "blue"), (True, "red")]:
+                sub = df_passes[df_passes.shot_assist == is_shot_assist]
+                arrows.append(
+                    pitch.arrows(sub.x.values, sub.y.values, sub.end_x.values, sub.end_y.values,
+                                 ax=ax,
+                                 color=color,
+                                 width=2,
+                                 alpha=0.7)
+                )
+
+            ax.set_title(title)
+            st.pyplot(fig)
+        finally:
+            # Strip this call's arrows so the cached figure is blank again
+            for a in arrows:
+                a.remove()
+
+@st.cache_data
+def build_final_third_passes(_df_events):
+    # The pass map only ever shows final-third passes, so that small subset is
+    # filtered once and indexed for direct (match, player) lookups
     return (
-        df[["player_id", "player_name"]]
-        .dropna()
-        .drop_duplicates()
-        .reset_index(drop=True)
+        _df_events[
+            (_df_events["event_type"] == "Pass") &
+            (_df_events["x"] >= FINAL_THIRD_X)
+        ]
+        .dropna(subset=["x", "y", "end_x", "end_y"])
+        .reset_index()
+        .set_index(["match_id", "player_id"])
+        .sort_index(kind="stable")
     )
 
 
+def get_player_match_passes(df_ft, match_id, player_id):
+    key = (match_id, player_id)
+    if key not in df_ft.index:
+        return df_ft.iloc[:0]
+
+    return df_ft.loc[[key]]
+
+
 def plot_messi_comparison(df, messi_id):
 
     fig, ax = plt.subplots(figsize=(12, 8))
 
-    # Scatter all players
-    ax.scatter(
+    # Scatter all players (a marker-only line is one path, unlike a PathCollection)
+    ax.plot(
         df["final_third_passes_per90"],
         df["xg_per90"],
-        s=90,
+        ls="",
+        marker="o",
+        ms=9.5,
         alpha=0.7,
         color="steelblue",
-        edgecolors="black",
-        linewidth=0.5,
+        mec="black",
+        mew=0.5,
         label="Other players"
     )
 
@@ -210,10 +384,10 @@ def plot_messi_comparison(df, messi_id):
     df_others = df[df["player_id"] != messi_id]
     top_xg_players = df_others.nlargest(5, "xg_per90")
 
-    for _, row in top_xg_players.iterrows():
+    for row in top_xg_players.itertuples(index=False):
         ax.annotate(
-            row["player_name"],
-            (row["final_third_passes_per90"], row["xg_per90"]),
+            row.player_name,
+            (row.final_third_passes_per90, row.xg_per90),
             xytext=(5, 5),
             textcoords="offset points",
             fontsize=9,
@@ -275,14 +449,14 @@ def main():
     # LOAD DATA
     # ===============================
     df_matches = load_matches()
-    df_events_clean = build_clean_events(df_matches)
+    df_events_clean, player_names = load_clean_events(df_matches)
 
     # ===============================
     # BUILD PER-90 DATASET
     # ===============================
     df_per90 = build_per90(df_events_clean)
-    df_players = get_player_lookup(df_events_clean)
-    df_per90_named = df_per90.merge(df_players, on="player_id", how="left")
+    df_per90_named = df_per90.assign(player_name=df_per90.player_id.map(player_names))
+    df_final_third_passes = build_final_third_passes(df_events_clean)
 
     # ===============================
     # CONSTANTS
@@ -296,28 +470,32 @@ def main():
     # ===============================
     st.sidebar.header("Match selection")
 
-    match_options = {
-        "Argentina vs Saudi Arabia": ("Argentina", "Saudi Arabia"),
-        "Argentina vs Mexico": ("Argentina", "Mexico")
-    }
+    match_options = [
+        ("Argentina", "Saudi Arabia"),
+        ("Argentina", "Mexico")
+    ]
 
-    selected_match_label = st.sidebar.selectbox(
+    match_ids = []
+    for team1, team2 in match_options:
+        match_id = find_match_id(df_matches, team1, team2)
+        if match_id is None:
+            st.error(f"No match found for {team1} vs {team2}")
+            st.stop()
+        match_ids.append(match_id)
+
+    label_by_id = dict(zip(df_matches["match_id"], df_matches["label"]))
+
+    match_id = st.sidebar.selectbox(
         "Select match",
-        options=list(match_options.keys())
+        options=match_ids,
+        format_func=label_by_id.get
     )
-
-    team1, team2 = match_options[selected_match_label]
-    match_id = find_match_id(df_matches, team1, team2)
+    selected_match_label = label_by_id[match_id]
 
     # ===============================
     # FILTER MESSI PASSES (MATCH-SPECIFIC)
     # ===============================
-    df_messi_match = df_events_clean[
-        (df_events_clean["match_id"] == match_id) &
-        (df_events_clean["player_name"] == MESSI_NAME) &
-        (df_events_clean["event_type"] == "Pass") &
-        (df_events_clean["x"] >= FINAL_THIRD_X)
-    ].dropna(subset=["x", "y", "end_x", "end_y"])
+    df_messi_match = get_player_match_passes(df_final_third_passes, match_id, MESSI_ID)
 
     # ===============================
     # VISUALISATIONS
@@ -0,0 +1,9 @@
+# build_cache.py
+# Prebuild the cleaned-events cache at deploy time, so the first Streamlit
+# session reads a single Parquet file instead of parsing every match JSON.
+
+from app import load_matches, load_clean_events
+
+if __name__ == "__main__":
+    df_events, player_names = load_clean_events(load_matches())
+    print(f"Cached {len(df_events)} events for {len(player_names)} players")